@@ -50,10 +50,10 @@ class GRU(GRUAbstract):
 
         '''
 
-        x_in = make_onehot(x, self.vocab_size)
-        r = sigmoid(self.Vr @ x_in + self.Ur @ s_previous)
-        z = sigmoid(self.Vz @ x_in + self.Uz @ s_previous)
-        h = np.tanh(self.Vh @ x_in + self.Uh @ (r * s_previous))
+        # V @ onehot(x) is just column x of V
+        r = sigmoid(self.Vr[:, x] + self.Ur @ s_previous)
+        z = sigmoid(self.Vz[:, x] + self.Uz @ s_previous)
+        h = np.tanh(self.Vh[:, x] + self.Uh @ (r * s_previous))
         s = z * s_previous + (1 - z) * h
         y = softmax(self.W @ s)
         return y, s, h, z, r
@@ -77,8 +77,8 @@ class GRU(GRUAbstract):
         no return values
         '''
         t = len(x)-1
-        one_hot_dt = make_onehot(d[0], self.out_vocab_size)
-        delta_output = (one_hot_dt - y[t])
+        delta_output = -y[t]
+        delta_output[d[0]] += 1
         self.backward(x, t, s, delta_output)
 
     def acc_deltas_bptt_np(self, x, d, y, s, steps):
@@ -100,6 +100,6 @@ class GRU(GRUAbstract):
         no return values
         '''
         t = len(x)-1
-        one_hot_dt = make_onehot(d[0], self.out_vocab_size)
-        delta_output = (one_hot_dt - y[t])
+        delta_output = -y[t]
+        delta_output[d[0]] += 1
         self.backward(x, t, s, delta_output, steps)
\ No newline at end of file
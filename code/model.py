@@ -80,6 +80,94 @@ class Model(object):
 
         pass
 
+    def predict_last_logits(self, x) -> np.ndarray:
+        '''
+        the output layer for the last input word, before the softmax, i.e. up to a constant the log of
+        the predicted probabilities at the last time step
+
+        models can override this to skip the output layer at all earlier time steps. this default just
+        takes the log of the last prediction of predict
+
+        x	list of words, as indices, e.g.: [0, 4, 2]
+
+        returns	vector of out_vocab_size scores, with the same argmax as the last prediction of predict
+        '''
+
+        y, _ = self.predict(x)
+        return np.log(y[len(x)-1])
+
+    def predict_into(self, x, y_buf, s_buf) -> (np.ndarray, np.ndarray):
+        '''
+        predict an output sequence y for a given input sequence x, reusing preallocated buffers
+
+        models can override this to write y and s into the leading rows of the buffers instead of
+        allocating them for every sentence. this default just calls predict and ignores the buffers.
+        the returned arrays may be views into the buffers, so they are only valid until the next call
+
+        x	list of words, as indices, e.g.: [0, 4, 2]
+        y_buf	buffer with at least len(x) rows, see prediction_buffers
+        s_buf	buffer with at least len(x)+1 rows
+
+        returns	y,s as for predict
+        '''
+
+        return self.predict(x)
+
+    def prediction_buffers(self, max_len) -> (np.ndarray, np.ndarray):
+        '''
+        allocate buffers for predict_into that fit any sentence of up to max_len words
+
+        returns	y_buf,s_buf
+        '''
+
+        dtype = np.result_type(*self._parameters.values())
+        return (np.empty((max_len, self.out_vocab_size), dtype=dtype),
+                np.empty((max_len + 1, self.hidden_dims), dtype=dtype))
+
+    def predict_batch(self, X) -> (np.ndarray, np.ndarray):
+        '''
+        predict output sequences for a batch of input sequences of the same length
+
+        models can override this with a batched forward pass. this default just runs predict on each row
+
+        X	batch of input sequences, as a (B, T) array of indices (see utils.pad_indices)
+
+        returns	Y,S
+        Y	(B, T, out_vocab_size) array of probability vectors for each input word
+        S	(B, T+1, hidden_dims) array of hidden layers for each input word, zero state last as in predict
+
+        '''
+
+        Y = np.zeros((X.shape[0], X.shape[1], self.out_vocab_size))
+        S = np.zeros((X.shape[0], X.shape[1] + 1, self.hidden_dims))
+        for b, x in enumerate(X):
+            Y[b], S[b] = self.predict(x)
+        return Y, S
+
+    def acc_deltas_batched(self, X, D, Y, S, mask=None) -> None:
+        '''
+        accumulate updates for V, W, U over a batch of sequences
+        standard back propagation
+
+        models can override this with batched updates. this default just runs acc_deltas on each
+        sequence of the batch, cut to its unpadded length
+
+        X	batch of input sequences, as a (B, T) array of indices (see utils.pad_indices)
+        D	batch of desired outputs, as a (B, T) array of indices
+        Y	predicted output layers for X, shape (B, T, out_vocab_size), see predict_batch
+        S	predicted hidden layers for X, shape (B, T+1, hidden_dims), zero state last
+        mask	optional (B, T) boolean array, False at the padding positions at the end of each sequence
+
+        no return values
+        '''
+
+        T = X.shape[1]
+        for b in range(X.shape[0]):
+            T_b = T if mask is None else int(np.sum(mask[b]))
+            # keep the zero state after the last word, where acc_deltas looks for it
+            s = np.concatenate((S[b, :T_b], S[b, T:]))
+            self.acc_deltas(X[b, :T_b], D[b, :T_b], Y[b, :T_b], s)
+
     @abc.abstractmethod
     def acc_deltas(self, x, d, y, s) -> None:
         '''
@@ -170,10 +258,6 @@ class Model(object):
         for delta in self._deltas.values():
             delta.fill(0.0)
 
-    def scale_gradients_for_batch(self, batch_size) -> None:
-        for delta in self._deltas.values():
-            delta /= batch_size
-
     def apply_deltas(self, learning_rate) -> None:
         '''
         update the RNN's weight matrices with corrections accumulated over some training instances
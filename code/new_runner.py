@@ -1,14 +1,33 @@
 # coding: utf-8
+import logging
+import os
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+from itertools import product
+
+if __name__ == "__main__":
+    # the matrix products of these models are far too small to gain from a BLAS thread pool, so run
+    # BLAS single-threaded. this has to be set before numpy is first imported, and is inherited by
+    # the hyperparameter search workers, which provide the parallelism instead
+    os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+    os.environ.setdefault('MKL_NUM_THREADS', '1')
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
 
 from utils import *
 from rnnmath import *
-from sys import stdout
 from model import Model
 from rnn import RNN
 from gru import GRU
 
+logger = logging.getLogger(__name__)
+
+
+def _print_message(msg, *args):
+    # stands in for logger.info when logging has not been configured, so log=True still prints
+    print(msg % args)
 
 class NewRunner(object):
     '''
@@ -28,6 +47,33 @@ class NewRunner(object):
     def __init__(self, model: Model):
         self.model = model
 
+    @staticmethod
+    def _loss_from_y(y, d):
+        '''
+        compute the loss w.r.t. d from predictions y that have already been made
+
+        y		matrix of predicted word distributions, one row per time step
+        d		list of words, as indices, e.g.: [4, 2, 3]
+
+        return loss		the combined loss for all words
+        '''
+        # pick the predicted probability of each desired word straight out of y
+        d = np.asarray(d)
+        return -np.sum(np.log(y[np.arange(len(d)), d]))
+
+    @staticmethod
+    def _loss_from_y_np(y, d):
+        '''
+        compute the loss w.r.t. d from predictions y that have already been made,
+        taking only the prediction from the last time step
+
+        y		matrix of predicted distributions, one row per time step
+        d		a word, as indices, e.g.: [0]
+
+        return loss
+        '''
+        return -np.log(y[len(y)-1][d[0]])
+
     def compute_loss(self, x, d):
         '''
         compute the loss between predictions y for x, and desired output d.
@@ -39,13 +85,8 @@ class NewRunner(object):
 
         return loss		the combined loss for all words
         '''
-        loss = 0.
         y, _ = self.model.predict(x)
-        for t in range(len(x)):
-            y_true = make_onehot(d[t], self.model.vocab_size)
-            log_y_pred = np.log(y[t])
-            loss -= np.dot(y_true, log_y_pred)
-        return loss
+        return self._loss_from_y(y, d)
 
     def compute_loss_np(self, x, d):
         '''
@@ -58,13 +99,8 @@ class NewRunner(object):
 
         return loss		we only take the prediction from the last time step
         '''
-        loss = 0.
         y, _ = self.model.predict(x)
-        t = len(x)-1
-        log_y_pred = np.log(y[t])
-        one_hot_dt = make_onehot(d[0], self.model.out_vocab_size)
-        loss -= np.dot(one_hot_dt, log_y_pred)
-        return loss
+        return self._loss_from_y_np(y, d)
 
     def compute_acc_np(self, x, d):
         '''
@@ -76,28 +112,66 @@ class NewRunner(object):
 
         return 1 if argmax(y[t]) == d[0], 0 otherwise
         '''
-        y, _ = self.model.predict(x)
-        t = len(x)-1
-        return int(np.argmax(y[t]) == d[0])
+        # the softmax does not change the argmax, so the scores before it are enough
+        return int(np.argmax(self.model.predict_last_logits(x)) == d[0])
 
-    def compute_mean_loss(self, X, D):
+    def compute_mean_loss(self, X, D, batch_size=32):
         '''
         compute the mean loss between predictions for corpus X and desired outputs in corpus D.
 
+        sentences are sorted by length and predicted in padded batches, so each batch is a single
+        batched forward pass of the model
+
         X		corpus of sentences x1, x2, x3, [...], each a list of words as indices.
         D		corpus of desired outputs d1, d2, d3 [...], each a list of words as indices.
+        batch_size	number of sentences to predict at once. default 32
 
         return mean_loss		average loss over all words in D
         '''
         mean_loss = 0.
         word_count = 0
-        for x, d in zip(X, D):
-            mean_loss += self.compute_loss(x, d)
-            word_count += len(x)
+        order = np.argsort([len(x) for x in X], kind='stable')
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            X_b, mask = pad_indices([X[i] for i in batch])
+            D_b, _ = pad_indices([D[i] for i in batch])
+            Y, _ = self.model.predict_batch(X_b)
+            B, T = X_b.shape
+            p = Y[np.arange(B)[:, None], np.arange(T), D_b]
+            mean_loss -= np.sum(np.log(p[mask]))
+            word_count += np.sum(mask)
         return mean_loss / word_count
 
-    def train(self, X, D, X_dev, D_dev, epochs=10, learning_rate=0.5, anneal=5, back_steps=0, batch_size=100,
-              min_change=0.0001, log=True):
+    def _eval_np(self, X, D, batch_size=32):
+        '''
+        compute the mean loss and the accuracy of the binary predictions for corpus X and desired outputs D.
+
+        like compute_mean_loss, sentences are sorted by length and predicted in padded batches. both
+        measures are taken from the same prediction, at the last word of each sentence
+
+        X		corpus of sentences x1, x2, x3, [...], each a list of words as indices.
+        D		corpus of desired outputs d1, d2, d3 [...], each a word class as index, e.g.: [0] or [1]
+        batch_size	number of sentences to predict at once. default 32
+
+        return mean_loss, mean_acc
+        '''
+        loss = 0.
+        correct = 0
+        lengths = np.array([len(x) for x in X])
+        order = np.argsort(lengths, kind='stable')
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            X_b, _ = pad_indices([X[i] for i in batch])
+            d_b = np.array([D[i][0] for i in batch])
+            Y, _ = self.model.predict_batch(X_b)
+            # padding only comes after the last word, so it does not change the prediction there
+            y_last = Y[np.arange(len(batch)), lengths[batch] - 1]
+            loss -= np.sum(np.log(y_last[np.arange(len(batch)), d_b]))
+            correct += np.sum(np.argmax(y_last, axis=1) == d_b)
+        return loss / len(X), correct / len(X)
+
+    def train(self, X, D, X_dev, D_dev, epochs=10, learning_rate=0.5, anneal=5, back_steps=0, micro_batch=1,
+              accumulation_steps=100, min_change=0.0001, log=True):
         '''
         train the model on some training set X, D while optimizing the loss on a dev set X_dev, D_dev
 
@@ -118,41 +192,54 @@ class NewRunner(object):
                         anneal=0 will not change the learning rate over time.
                         default 5
         back_steps		positive integer. number of timesteps for BPTT. if back_steps < 2, standard BP will be used. default 0
-        batch_size		number of training instances to use before updating the RNN's weight matrices.
-                        if set to 1, weights will be updated after each instance. if set to len(X), weights are only updated after each epoch.
+        micro_batch		number of training instances to predict and accumulate updates for at once. with standard BP,
+                        a micro batch is one batched forward and backward pass (see Model.acc_deltas_batched).
+                        default 1
+        accumulation_steps	number of micro batches to accumulate updates over before updating the RNN's weight matrices,
+                        i.e., weights are updated every micro_batch * accumulation_steps instances.
                         default 100
         min_change		minimum change in loss between 2 epochs. if the change in loss is smaller than min_change, training stops regardless of
                         number of epochs left.
                         default 0.0001
         log				whether or not to print out log messages. (default log=True)
         '''
+        # log messages go to the logger once logging is configured, and are printed otherwise
+        info = logger.info if logger.hasHandlers() else _print_message
         if log:
-            stdout.write(
-                "\nTraining model for {0} epochs\ntraining set: {1} sentences (batch size {2})".format(epochs, len(X),
-                                                                                                       batch_size))
-            stdout.write("\nOptimizing loss on {0} sentences".format(len(X_dev)))
-            stdout.write("\nVocab size: {0}\nHidden units: {1}".format(self.model.vocab_size, self.model.hidden_dims))
-            stdout.write("\nSteps for back propagation: {0}".format(back_steps))
-            stdout.write("\nInitial learning rate set to {0}, annealing set to {1}".format(learning_rate, anneal))
-            stdout.write("\n\ncalculating initial mean loss on dev set")
-            stdout.flush()
-
-        t_start = time.time()
-        loss_function = self.compute_loss
-
-        loss_sum = sum([len(d) for d in D_dev])
-        initial_loss = sum([loss_function(X_dev[i], D_dev[i]) for i in range(len(X_dev))]) / loss_sum
-
-        if log or not log:
-            stdout.write(": {0}\n".format(initial_loss))
-            stdout.flush()
+            info("Training model for %d epochs", epochs)
+            info("training set: %d sentences (micro batch %d, %d micro batches per update)", len(X),
+                 micro_batch, accumulation_steps)
+            info("Optimizing loss on %d sentences", len(X_dev))
+            info("Vocab size: %d", self.model.vocab_size)
+            info("Hidden units: %d", self.model.hidden_dims)
+            info("Steps for back propagation: %d", back_steps)
+            info("Initial learning rate set to %s, annealing set to %s", learning_rate, anneal)
+
+        initial_loss = self.compute_mean_loss(X_dev, D_dev)
+
+        print("initial mean loss on dev set: {0}".format(initial_loss))
 
         prev_loss = initial_loss
-        loss_watch_count = -1
         min_change_count = -1
 
         a0 = learning_rate
 
+        n_train = len(X)
+        update_size = micro_batch * accumulation_steps
+        # every sentence is predicted into the same buffers, sized for the longest one
+        y_buf, s_buf = self.model.prediction_buffers(max(len(x) for x in X))
+        predict = partial(self.model.predict_into, y_buf=y_buf, s_buf=s_buf)
+        apply_deltas = self.model.apply_deltas
+        log_progress = log and logger.isEnabledFor(logging.DEBUG)
+        if back_steps == 0:
+            acc_deltas = self.model.acc_deltas
+        else:
+            acc_deltas = partial(self.model.acc_deltas_bptt, steps=back_steps)
+        # there is only a batched version of standard BP, BPTT goes through a micro batch one instance at a time
+        batched = micro_batch > 1 and back_steps == 0
+        predict_batch = self.model.predict_batch
+        acc_deltas_batched = self.model.acc_deltas_batched
+
         best_loss = initial_loss
         self.model.save_params()
         best_epoch = 0
@@ -164,47 +251,45 @@ class NewRunner(object):
                 learning_rate = a0
 
             if log:
-                stdout.write("\nepoch %d, learning rate %.04f" % (epoch + 1, learning_rate))
-                stdout.flush()
+                info("epoch %d, learning rate %.04f", epoch + 1, learning_rate)
 
             t0 = time.time()
-            count = 0
 
             # use random sequence of instances in the training set (tries to avoid local maxima when training on batches)
-            permutation = np.random.permutation(range(len(X)))
-            if log:
-                stdout.write("\tinstance 1")
-            for i in range(len(X)):
-                c = i + 1
-                if log:
-                    stdout.write("\b" * len(str(i)))
-                    stdout.write("{0}".format(c))
-                    stdout.flush()
-                p = permutation[i]
-                x_p = X[p]
-                d_p = D[p]
-
-                y_p, s_p = self.model.predict(x_p)
-                if back_steps == 0:
-                    self.model.acc_deltas(x_p, d_p, y_p, s_p)
+            permutation = np.random.permutation(len(X)).tolist()
+            for start in range(0, n_train, micro_batch):
+                batch = permutation[start:start + micro_batch]
+                c = start + len(batch)
+                # only report progress every few hundred instances, logging every instance
+                # costs more than a training step on small models
+                if log_progress and (c // 256 > start // 256 or c == n_train):
+                    logger.debug("instance %d of %d", c, n_train)
+
+                if batched:
+                    X_b, mask = pad_indices([X[p] for p in batch])
+                    D_b, _ = pad_indices([D[p] for p in batch])
+                    Y_b, S_b = predict_batch(X_b)
+                    acc_deltas_batched(X_b, D_b, Y_b, S_b, mask)
                 else:
-                    self.model.acc_deltas_bptt(x_p, d_p, y_p, s_p, back_steps)
+                    for p in batch:
+                        x_p = X[p]
+                        d_p = D[p]
 
-                if i % batch_size == 0:
-                    self.model.scale_gradients_for_batch(batch_size)
-                    self.model.apply_deltas(learning_rate)
+                        y_p, s_p = predict(x_p)
+                        acc_deltas(x_p, d_p, y_p, s_p)
 
-            if len(X) % batch_size > 0:
-                mod = len(X) % batch_size
-                self.model.scale_gradients_for_batch(mod)
-                self.model.apply_deltas(learning_rate)
+                # updates are due after every update_size instances, only the end of a full micro batch can fall on one
+                if c % update_size == 0:
+                    apply_deltas(learning_rate / update_size)
 
-            loss = sum([loss_function(X_dev[i], D_dev[i]) for i in range(len(X_dev))]) / loss_sum
+            if n_train % update_size > 0:
+                mod = n_train % update_size
+                apply_deltas(learning_rate / mod)
+
+            loss = self.compute_mean_loss(X_dev, D_dev)
 
             if log:
-                stdout.write("\tepoch done in %.02f seconds" % (time.time() - t0))
-                stdout.write("\tnew loss: {0}".format(loss))
-                stdout.flush()
+                info("epoch done in %.02f seconds\tnew loss: %s", time.time() - t0, loss)
 
             if loss < best_loss:
                 best_loss = loss
@@ -217,24 +302,22 @@ class NewRunner(object):
             else:
                 min_change_count = 0
             if min_change_count > 2:
-                print("\n\ntraining finished after {0} epochs due to minimal change in loss".format(epoch + 1))
+                print("training finished after {0} epochs due to minimal change in loss".format(epoch + 1))
                 break
 
             prev_loss = loss
 
-        t = time.time() - t_start
-
         if min_change_count <= 2:
-            print("\n\ntraining finished after reaching maximum of {0} epochs".format(epochs))
-        print("best observed loss was {0}, at epoch {1}".format(best_loss, (best_epoch + 1)))
+            print("training finished after reaching maximum of {0} epochs".format(epochs))
+        print("best observed loss was {0}, at epoch {1}".format(best_loss, best_epoch + 1))
 
         print("setting parameters to matrices from best epoch")
         self.model.set_best_params()
 
         return best_loss
 
-    def train_np(self, X, D, X_dev, D_dev, epochs=10, learning_rate=0.5, anneal=5, back_steps=0, batch_size=100,
-                 min_change=0.0001, log=True):
+    def train_np(self, X, D, X_dev, D_dev, epochs=10, learning_rate=0.5, anneal=5, back_steps=0, micro_batch=1,
+                 accumulation_steps=100, min_change=0.0001, log=True):
         '''
         train the model on some training set X, D while optimizing the loss on a dev set X_dev, D_dev
 
@@ -255,48 +338,56 @@ class NewRunner(object):
                         anneal=0 will not change the learning rate over time.
                         default 5
         back_steps		positive integer. number of timesteps for BPTT. if back_steps < 2, standard BP will be used. default 0
-        batch_size		number of training instances to use before updating the RNN's weight matrices.
-                        if set to 1, weights will be updated after each instance. if set to len(X), weights are only updated after each epoch.
+        micro_batch		number of training instances to accumulate updates for at once. each instance is still
+                        predicted on its own, there is no batched BP for number predictions.
+                        default 1
+        accumulation_steps	number of micro batches to accumulate updates over before updating the RNN's weight matrices,
+                        i.e., weights are updated every micro_batch * accumulation_steps instances.
                         default 100
         min_change		minimum change in loss between 2 epochs. if the change in loss is smaller than min_change, training stops regardless of
                         number of epochs left.
                         default 0.0001
         log				whether or not to print out log messages. (default log=True)
         '''
+        # log messages go to the logger once logging is configured, and are printed otherwise
+        info = logger.info if logger.hasHandlers() else _print_message
         if log:
-            stdout.write(
-                "\nTraining model for {0} epochs\ntraining set: {1} sentences (batch size {2})".format(epochs, len(X),
-                                                                                                       batch_size))
-            stdout.write("\nOptimizing loss on {0} sentences".format(len(X_dev)))
-            stdout.write("\nVocab size: {0}\nHidden units: {1}".format(self.model.vocab_size, self.model.hidden_dims))
-            stdout.write("\nSteps for back propagation: {0}".format(back_steps))
-            stdout.write("\nInitial learning rate set to {0}, annealing set to {1}".format(learning_rate, anneal))
-            stdout.flush()
-
-        t_start = time.time()
-        loss_function = self.compute_loss_np
-
-        loss_sum = len(D_dev)
-        initial_loss = sum([loss_function(X_dev[i], D_dev[i]) for i in range(len(X_dev))]) / loss_sum
-        initial_acc = sum([self.compute_acc_np(X_dev[i], D_dev[i]) for i in range(len(X_dev))]) / len(X_dev)
-
-        if log or not log:
-            stdout.write("\n\ncalculating initial mean loss on dev set")
-            stdout.write(": {0}\n".format(initial_loss))
-            stdout.write("calculating initial acc on dev set")
-            stdout.write(": {0}\n".format(initial_acc))
-            stdout.flush()
+            info("Training model for %d epochs", epochs)
+            info("training set: %d sentences (micro batch %d, %d micro batches per update)", len(X),
+                 micro_batch, accumulation_steps)
+            info("Optimizing loss on %d sentences", len(X_dev))
+            info("Vocab size: %d", self.model.vocab_size)
+            info("Hidden units: %d", self.model.hidden_dims)
+            info("Steps for back propagation: %d", back_steps)
+            info("Initial learning rate set to %s, annealing set to %s", learning_rate, anneal)
+
+        initial_loss, initial_acc = self._eval_np(X_dev, D_dev)
+
+        print("initial mean loss on dev set: {0}".format(initial_loss))
+        print("initial acc on dev set: {0}".format(initial_acc))
 
         prev_loss = initial_loss
-        loss_watch_count = -1
         min_change_count = -1
 
         a0 = learning_rate
 
+        n_train = len(X)
+        update_size = micro_batch * accumulation_steps
+        # every sentence is predicted into the same buffers, sized for the longest one
+        y_buf, s_buf = self.model.prediction_buffers(max(len(x) for x in X))
+        predict = partial(self.model.predict_into, y_buf=y_buf, s_buf=s_buf)
+        apply_deltas = self.model.apply_deltas
+        log_progress = log and logger.isEnabledFor(logging.DEBUG)
+        if back_steps == 0:
+            acc_deltas = self.model.acc_deltas_np
+        else:
+            acc_deltas = partial(self.model.acc_deltas_bptt_np, steps=back_steps)
+
         best_loss = initial_loss
         best_acc = initial_acc
         self.model.save_params()
         best_epoch = 0
+
         for epoch in range(epochs):
             if anneal > 0:
                 learning_rate = a0 / ((epoch + 0.0 + anneal) / anneal)
@@ -304,47 +395,39 @@ class NewRunner(object):
                 learning_rate = a0
 
             if log:
-                stdout.write("\nepoch %d, learning rate %.04f" % (epoch + 1, learning_rate))
-                stdout.flush()
+                info("epoch %d, learning rate %.04f", epoch + 1, learning_rate)
 
             t0 = time.time()
-            count = 0
 
             # use random sequence of instances in the training set (tries to avoid local maxima when training on batches)
-            permutation = np.random.permutation(range(len(X)))
-            if log:
-                stdout.write("\tinstance 1")
-            for i in range(len(X)):
-                c = i + 1
-                if log:
-                    stdout.write("\b" * len(str(i)))
-                    stdout.write("{0}".format(c))
-                    stdout.flush()
-                p = permutation[i]
-                x_p = X[p]
-                d_p = D[p]
-
-                y_p, s_p = self.model.predict(x_p)
-                if back_steps == 0:
-                    self.model.acc_deltas_np(x_p, d_p, y_p, s_p)
-                else:
-                    self.model.acc_deltas_bptt_np(x_p, d_p, y_p, s_p, back_steps)
-                if i % batch_size == 0:
-                    self.model.scale_gradients_for_batch(batch_size)
-                    self.model.apply_deltas(learning_rate)
-            if len(X) % batch_size > 0:
-                mod = len(X) % batch_size
-                self.model.scale_gradients_for_batch(mod)
-                self.model.apply_deltas(learning_rate)
-
-            loss = sum([loss_function(X_dev[i], D_dev[i]) for i in range(len(X_dev))]) / loss_sum
-            acc = sum([self.compute_acc_np(X_dev[i], D_dev[i]) for i in range(len(X_dev))]) / len(X_dev)
+            permutation = np.random.permutation(len(X)).tolist()
+            for start in range(0, n_train, micro_batch):
+                batch = permutation[start:start + micro_batch]
+                c = start + len(batch)
+                # only report progress every few hundred instances, logging every instance
+                # costs more than a training step on small models
+                if log_progress and (c // 256 > start // 256 or c == n_train):
+                    logger.debug("instance %d of %d", c, n_train)
+
+                for p in batch:
+                    x_p = X[p]
+                    d_p = D[p]
+
+                    y_p, s_p = predict(x_p)
+                    acc_deltas(x_p, d_p, y_p, s_p)
+
+                # updates are due after every update_size instances, only the end of a full micro batch can fall on one
+                if c % update_size == 0:
+                    apply_deltas(learning_rate / update_size)
+
+            if n_train % update_size > 0:
+                mod = n_train % update_size
+                apply_deltas(learning_rate / mod)
+
+            loss, acc = self._eval_np(X_dev, D_dev)
 
             if log:
-                stdout.write("\tepoch done in %.02f seconds" % (time.time() - t0))
-                stdout.write("\tnew loss: {0}".format(loss))
-                stdout.write("\tnew acc: {0}".format(acc))
-                stdout.flush()
+                info("epoch done in %.02f seconds\tnew loss: %s\tnew acc: %s", time.time() - t0, loss, acc)
 
             if loss < best_loss:
                 best_loss = loss
@@ -358,24 +441,52 @@ class NewRunner(object):
             else:
                 min_change_count = 0
             if min_change_count > 2:
-                print("\n\ntraining finished after {0} epochs due to minimal change in loss".format(epoch + 1))
+                print("training finished after {0} epochs due to minimal change in loss".format(epoch + 1))
                 break
 
             prev_loss = loss
 
-        t = time.time() - t_start
-
         if min_change_count <= 2:
-            print("\n\ntraining finished after reaching maximum of {0} epochs".format(epochs))
-        print("best observed loss was {0}, acc {1}, at epoch {2}".format(best_loss, best_acc, (best_epoch + 1)))
+            print("training finished after reaching maximum of {0} epochs".format(epochs))
+        print("best observed loss was {0}, acc {1}, at epoch {2}".format(best_loss, best_acc, best_epoch + 1))
 
         print("setting U, V, W to matrices from best epoch")
         self.model.set_best_params()
 
         return best_loss
 
+
+# data shared by the hyperparameter search, set once in each worker process
+_trial_data = {}
+
+
+def _init_trial_worker(data):
+    _trial_data.update(data)
+
+
+def _lm_trial(params):
+    '''
+    train a language model RNN with one setting of the hyperparameters, in a worker process
+
+    params		tuple (hidden_dims, learning_rate, back_steps, seed)
+
+    return hidden_dims, learning_rate, back_steps, mean loss on the dev set
+    '''
+    hidden_dims, learning_rate, back_steps, seed = params
+    np.random.seed(seed)
+    data = _trial_data
+    rnn = RNN(vocab_size=data['vocab_size'], hidden_dims=hidden_dims, out_vocab_size=data['vocab_size'])
+    runner = NewRunner(rnn)
+    # train prints its summary regardless of log, which would interleave unlabelled across the
+    # workers. the parent reports each trial with its parameters instead
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        runner.train(X=data['X_train'], D=data['D_train'], X_dev=data['X_dev'], D_dev=data['D_dev'],
+                     learning_rate=learning_rate, back_steps=back_steps, log=False)
+    return hidden_dims, learning_rate, back_steps, runner.compute_mean_loss(X=data['X_dev'], D=data['D_dev'])
+
 if __name__ == "__main__":
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
     mode = sys.argv[1].lower()
     data_folder = sys.argv[2]
     np.random.seed(2018)
@@ -406,18 +517,15 @@ if __name__ == "__main__":
             "Retained %d words from %d (%.02f%% of all tokens)\n" % (
             vocab_size, len(vocab), 100 * (1 - fraction_lost)))
 
-        docs = load_lm_dataset(data_folder + '/wiki-train.txt')
-        S_train = docs_to_indices(docs, word_to_num, 1, 1)
+        S_train = load_indexed_dataset(data_folder + '/wiki-train.txt', load_lm_dataset, word_to_num, 1, 1)
         X_train, D_train = seqs_to_lmXY(S_train)
 
         # Load the dev set (for tuning hyperparameters)
-        docs = load_lm_dataset(data_folder + '/wiki-dev.txt')
-        S_dev = docs_to_indices(docs, word_to_num, 1, 1)
+        S_dev = load_indexed_dataset(data_folder + '/wiki-dev.txt', load_lm_dataset, word_to_num, 1, 1)
         X_dev, D_dev = seqs_to_lmXY(S_dev)
 
         # Load the test set
-        docs = load_lm_dataset(data_folder + '/wiki-test.txt')
-        S_test = docs_to_indices(docs, word_to_num, 1, 1)
+        S_test = load_indexed_dataset(data_folder + '/wiki-test.txt', load_lm_dataset, word_to_num, 1, 1)
         X_test, D_test = seqs_to_lmXY(S_test)
 
         X_train = X_train[:train_size]
@@ -434,29 +542,22 @@ if __name__ == "__main__":
             hidden_dim_params = [25, 50] # 25
             lr_params = [0.5, 0.1, 0.05] # 0.5
             lookback_params = [0, 2, 5]  # 5
-            min_loss = None # 4.933136297644713
-            best_hidden_dim = None
-            best_lr = None
-            best_lookback = None
-            for hidden_dim_param in hidden_dim_params:
-                for lr_param in lr_params:
-                    for lookback_param in lookback_params:
-                        print("Params: Hidden Dim = {}, Learning Rate = {}, Lookback = {}".format(hidden_dim_param, lr_param, lookback_param))
-                        rnn = RNN(vocab_size=vocab_size, hidden_dims=hidden_dim_param, out_vocab_size=vocab_size)
-                        runner = NewRunner(rnn)
-                        runner.train(X=X_train, D=D_train, X_dev=X_dev, D_dev=D_dev, learning_rate=lr_param, back_steps=lookback_param)
-
-                        run_loss = runner.compute_mean_loss(X=X_dev, D=D_dev)
-                        adjusted_loss = adjust_loss(run_loss, fraction_lost, q)
-                        print("Cross Entropy Loss: %.03f" % run_loss)
-                        print()
-                        if min_loss == None:
-                            min_loss = run_loss
-                        elif min_loss != None and run_loss < min_loss:
-                            best_hidden_dim = hidden_dim_param
-                            best_lr = lr_param
-                            best_lookback = lookback_param
-                            min_loss = run_loss
+            # min loss 4.933136297644713
+            # every setting is trained independently, so run them in parallel, one per process
+            trials = [params + (2018 + i,) for i, params in
+                      enumerate(product(hidden_dim_params, lr_params, lookback_params))]
+            data = dict(vocab_size=vocab_size, X_train=X_train, D_train=D_train, X_dev=X_dev, D_dev=D_dev)
+            with ProcessPoolExecutor(max_workers=min(len(trials), os.cpu_count()), initializer=_init_trial_worker,
+                                     initargs=(data,)) as executor:
+                # results come back in grid order, report each one as soon as it is in
+                results = []
+                for result in executor.map(_lm_trial, trials):
+                    hidden_dim_param, lr_param, lookback_param, run_loss = result
+                    print("Params: Hidden Dim = {}, Learning Rate = {}, Lookback = {}".format(hidden_dim_param, lr_param, lookback_param))
+                    print("Cross Entropy Loss: %.03f" % run_loss)
+                    print()
+                    results.append(result)
+            best_hidden_dim, best_lr, best_lookback, min_loss = min(results, key=lambda result: result[3])
             print("Best parameters: Hidden Hidden Dim = {}, Learning Rate = {}, Lookback = {}".format(best_hidden_dim, best_lr, best_lookback))
             print("Minimum Loss: {}".format(min_loss))
         else:
@@ -474,10 +575,7 @@ if __name__ == "__main__":
             print("Unadjusted Perplexity: %.03f" % np.exp(test_run_loss))
             print("Adjusted Perplexity for missing vocab: %.03f" % np.exp(test_adjusted_loss))
 
-            np.save('rnn.U.npy', rnn.U)\
-            
-            np.save('rnn.V.npy', rnn.V)
-            np.save('rnn.W.npy', rnn.W)
+            np.savez_compressed('rnn_params.npz', U=rnn.U, V=rnn.V, W=rnn.W)
 
     if mode == "train-np-rnn":
         '''
@@ -506,16 +604,14 @@ if __name__ == "__main__":
             vocab_size, len(vocab), 100 * (1 - fraction_lost)))
 
         # load training data
-        sents = load_np_dataset(data_folder + '/wiki-train.txt')
-        S_train = docs_to_indices(sents, word_to_num, 0, 0)
+        S_train = load_indexed_dataset(data_folder + '/wiki-train.txt', load_np_dataset, word_to_num, 0, 0)
         X_train, D_train = seqs_to_npXY(S_train)
 
         X_train = X_train[:train_size]
         Y_train = D_train[:train_size]
 
         # load development data
-        sents = load_np_dataset(data_folder + '/wiki-dev.txt')
-        S_dev = docs_to_indices(sents, word_to_num, 0, 0)
+        S_dev = load_indexed_dataset(data_folder + '/wiki-dev.txt', load_np_dataset, word_to_num, 0, 0)
         X_dev, D_dev = seqs_to_npXY(S_dev)
 
         X_dev = X_dev[:dev_size]
@@ -531,7 +627,7 @@ if __name__ == "__main__":
                 runner_np = NewRunner(rnn_np)
                 runner_np.train_np(X=X_train, D=D_train, X_dev=X_dev, D_dev=D_dev, learning_rate=lr, back_steps=lookback)
 
-                acc = sum([runner_np.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)]) / len(X_dev)
+                acc = sum(runner_np.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)) / len(X_dev)
                 print("Accuracy: %.03f" % acc)
 
                 if acc > max_acc:
@@ -543,7 +639,7 @@ if __name__ == "__main__":
             runner = NewRunner(rnn)
             runner.train_np(X=X_train, D=D_train, X_dev=X_dev, D_dev=D_dev, learning_rate=lr, back_steps=lookback)
 
-            acc = sum([runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)]) / len(X_dev)
+            acc = sum(runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)) / len(X_dev)
             print("Accuracy: %.03f" % acc)
 
     if mode == "train-np-gru":
@@ -573,16 +669,14 @@ if __name__ == "__main__":
             vocab_size, len(vocab), 100 * (1 - fraction_lost)))
 
         # load training data
-        sents = load_np_dataset(data_folder + '/wiki-train.txt')
-        S_train = docs_to_indices(sents, word_to_num, 0, 0)
+        S_train = load_indexed_dataset(data_folder + '/wiki-train.txt', load_np_dataset, word_to_num, 0, 0)
         X_train, D_train = seqs_to_npXY(S_train)
 
         X_train = X_train[:train_size]
         Y_train = D_train[:train_size]
 
         # load development data
-        sents = load_np_dataset(data_folder + '/wiki-dev.txt')
-        S_dev = docs_to_indices(sents, word_to_num, 0, 0)
+        S_dev = load_indexed_dataset(data_folder + '/wiki-dev.txt', load_np_dataset, word_to_num, 0, 0)
         X_dev, D_dev = seqs_to_npXY(S_dev)
 
         X_dev = X_dev[:dev_size]
@@ -598,7 +692,7 @@ if __name__ == "__main__":
                 runner = NewRunner(gru)
                 runner.train_np(X=X_train, D=D_train, X_dev=X_dev, D_dev=D_dev, learning_rate=lr, back_steps=lookback_param)
 
-                acc = sum([runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)]) / len(X_dev)
+                acc = sum(runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)) / len(X_dev)
                 print("Accuracy: %.03f" % acc)
 
                 # if acc > max_acc:
@@ -610,7 +704,7 @@ if __name__ == "__main__":
             runner = NewRunner(gru)
             runner.train_np(X=X_train, D=D_train, X_dev=X_dev, D_dev=D_dev, learning_rate=lr, back_steps=lookback)
 
-            acc = sum([runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)]) / len(X_dev)
+            acc = sum(runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)) / len(X_dev)
             print("Accuracy: %.03f" % acc)
             
                     
@@ -626,7 +720,7 @@ if __name__ == "__main__":
                 runner = NewRunner(gru)
                 runner.train_np(X=X_train, D=D_train, X_dev=X_dev, D_dev=D_dev, learning_rate=lr_param, back_steps=lookback_param)
                 
-                acc = sum([runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)]) / len(X_dev)
+                acc = sum(runner.compute_acc_np(x, d) for x, d in zip(X_dev, D_dev)) / len(X_dev)
                 print("Accuracy: %.03f" % acc)
                 
                 if acc > max_acc:
@@ -18,7 +18,7 @@ class RNN(Model):
 	Do NOT change any method signatures!
 	'''
 	
-	def __init__(self, vocab_size, hidden_dims, out_vocab_size):
+	def __init__(self, vocab_size, hidden_dims, out_vocab_size, fp32=False):
 		'''
 		initialize the RNN with random weight matrices.
 		
@@ -27,15 +27,17 @@ class RNN(Model):
 		vocab_size		size of vocabulary that is being used
 		hidden_dims		number of hidden units
 		out_vocab_size	size of the output vocabulary
+		fp32			store weights, deltas and predictions as float32 instead of float64. default False
 		'''
 
 		super().__init__(vocab_size, hidden_dims, out_vocab_size)
+		dtype = np.float32 if fp32 else np.float64
 
 		# matrices V (input -> hidden), W (hidden -> output), U (hidden -> hidden)
 		with is_param():
-			self.U = np.random.randn(self.hidden_dims, self.hidden_dims)*np.sqrt(0.1)
-			self.V = np.random.randn(self.hidden_dims, self.vocab_size)*np.sqrt(0.1)
-			self.W = np.random.randn(self.out_vocab_size, self.hidden_dims)*np.sqrt(0.1)
+			self.U = (np.random.randn(self.hidden_dims, self.hidden_dims)*np.sqrt(0.1)).astype(dtype)
+			self.V = (np.random.randn(self.hidden_dims, self.vocab_size)*np.sqrt(0.1)).astype(dtype)
+			self.W = (np.random.randn(self.out_vocab_size, self.hidden_dims)*np.sqrt(0.1)).astype(dtype)
 
 		# matrices to accumulate weight updates
 		with is_delta():
@@ -58,16 +60,105 @@ class RNN(Model):
 		# matrix s for hidden states, y for output states, given input x.
 		# rows correspond to times t, i.e., input words
 		# s has one more row, since we need to look back even at time 0 (s(t=0-1) will just be [0. 0. ....] )
-		s = np.zeros((len(x) + 1, self.hidden_dims))
-		y = np.zeros((len(x), self.out_vocab_size))
-
-		for t in range(len(x)):
-			one_hot_x = make_onehot(x[t], self.vocab_size)
-			net_in = (self.V @ one_hot_x) + (self.U @ s[t-1])
-			s[t] = sigmoid(net_in)
-			net_out = self.W @ s[t]
-			y[t] = softmax(net_out)
+		s = np.zeros((len(x) + 1, self.hidden_dims), dtype=self.U.dtype)
+
+		# V @ onehot(x[t]) is just column x[t] of V, so gather all input columns at once.
+		# gathered time-major (T x H) like s, so Vx[t] is a contiguous row
+		self._recurrence(self.V.T[np.asarray(x)], s)
+
+		# the output layer does not feed back into the recurrence, so compute it for all t in one GEMM
+		net_out = s[:len(x)] @ self.W.T
+		y = softmax(net_out, out=net_out)
+		return y, s
+
+	def predict_last_logits(self, x):
+		'''
+		the output layer for the last input word, before the softmax
+
+		only the hidden layers are run for every word, the output layer is only computed for the last one
+
+		x	list of words, as indices, e.g.: [0, 4, 2]
+
+		returns	W @ s(T-1), the pre-softmax output layer at the last time step
+		'''
+		T = len(x)
+		s = np.zeros((T + 1, self.hidden_dims), dtype=self.U.dtype)
+		self._recurrence(self.V.T[np.asarray(x)], s)
+		return self.W @ s[T-1]
+
+	def predict_into(self, x, y_buf, s_buf):
+		'''
+		same as predict, but writes y and s into the leading rows of preallocated buffers
+
+		x		list of words, as indices, e.g.: [0, 4, 2]
+		y_buf	buffer with at least len(x) rows, see Model.prediction_buffers
+		s_buf	buffer with at least len(x)+1 rows
+
+		returns	y,s
+		y		view of the first len(x) rows of y_buf
+		s		view of the first len(x)+1 rows of s_buf
+		'''
+		T = len(x)
+		s = s_buf[:T+1]
+		s[T] = 0
+		self._recurrence(self.V.T[np.asarray(x)], s)
+
+		y = np.matmul(s[:T], self.W.T, out=y_buf[:T])
+		softmax(y, out=y)
 		return y, s
+
+	def predict_batch(self, X):
+		'''
+		predict output sequences for a batch of input sequences of the same length
+
+		same as calling predict on each row of X, but the recurrence of the whole batch is advanced
+		with one matrix product per time step
+
+		X	batch of input sequences, as a (B, T) array of indices
+
+		returns	Y,S
+		Y	(B, T, out_vocab_size) array of probability vectors for each input word
+		S	(B, T+1, hidden_dims) array of hidden layers for each input word, zero state last as in predict
+
+		'''
+		X = np.asarray(X)
+		B, T = X.shape
+
+		# computed time-major, so the states of the whole batch at time t are one contiguous block
+		s = np.zeros((T + 1, B, self.hidden_dims), dtype=self.U.dtype)
+		self._recurrence(self.V.T[X.T], s)
+
+		net_out = s[:T] @ self.W.T
+		y = softmax(net_out, out=net_out)
+		return y.transpose(1, 0, 2), s.transpose(1, 0, 2)
+
+	def _recurrence(self, Vx, s):
+		'''
+		run the hidden layer over time-major inputs, writing s[t] for t = 0, ..., T-1.
+		works on a single sequence or on a batch of them stacked along the second axis
+
+		Vx	the columns of V for each input word, one row (or block of rows) per time step
+		s	the hidden states, with the initial state s(0-1) already in s[T]
+		'''
+		# one buffer for the net input, reused at every time step
+		net_in = np.empty(s.shape[1:], dtype=s.dtype)
+		U_T = self.U.T
+		s_prev = s[len(Vx)]
+		for t in range(len(Vx)):
+			np.matmul(s_prev, U_T, out=net_in)
+			net_in += Vx[t]
+			sigmoid(net_in, out=s[t])
+			s_prev = s[t]
+
+	def _previous_states(self, s, T):
+		'''
+		hidden states one step back for each of the T time steps, i.e. row t is s(t-1).
+		works on a single s or on a batch of them stacked along the first axis
+
+		s(0-1) is the zero row that predict keeps after the last time step, so row 0 is taken
+		from s[T] explicitly rather than by letting s[t-1] wrap around to s[-1].
+		'''
+		return np.concatenate((s[..., T:T+1, :], s[..., :T-1, :]), axis=-2)
 	
 	def acc_deltas(self, x, d, y, s):
 		'''
@@ -85,19 +176,57 @@ class RNN(Model):
 		
 		no return values
 		'''
-		for t in reversed(range(len(x))):
-			# deltaW Updates
-			one_hot_dt = make_onehot(d[t], self.out_vocab_size)
-			delta_out = one_hot_dt - y[t]
-			self.deltaW += np.outer(delta_out, s[t])
+		x = np.asarray(x)
+		T = len(x)
+
+		# delta_out = onehot(d) - y and delta_in for all time steps at once, one row per t
+		delta_out = -y[:T]
+		delta_out[np.arange(T), d] += 1
+		delta_in = (delta_out @ self.W) * grad(s[:T])
+
+		# deltaW Updates
+		self.deltaW += delta_out.T @ s[:T]
+
+		# deltaV Updates
+		np.add.at(self.deltaV.T, x, delta_in)
+
+		# deltaU Updates
+		self.deltaU += delta_in.T @ self._previous_states(s, T)
+
+	def acc_deltas_batched(self, X, D, Y, S, mask=None):
+		'''
+		accumulate updates for V, W, U over a batch of sequences
+		standard back propagation
+
+		same as calling acc_deltas on each sequence of the batch, but the updates for the whole batch
+		are applied as a few batched contractions
+
+		X		batch of input sequences of the same length T, as a (B, T) array of indices
+		D		batch of desired outputs, as a (B, T) array of indices
+		Y		predicted output layers for X, shape (B, T, out_vocab_size)
+		S		predicted hidden layers for X, shape (B, T+1, hidden_dims), with the zero state last as in predict
+		mask	optional (B, T) boolean array, False at padding positions that should not contribute
+
+		no return values
+		'''
+		X = np.asarray(X)
+		B, T = X.shape
+
+		# delta_out = onehot(D) - Y and delta_in for every sequence and time step at once
+		delta_out = -Y[:, :T]
+		delta_out[np.arange(B)[:, None], np.arange(T), D] += 1
+		if mask is not None:
+			delta_out *= mask[:, :, None]
+		delta_in = (delta_out @ self.W) * grad(S[:, :T])
+
+		# deltaW Updates
+		self.deltaW += np.einsum('btv,bth->vh', delta_out, S[:, :T], optimize=True)
 
-			# deltaV Updates
-			delta_in = np.dot(np.transpose(self.W), delta_out) * grad(s[t])
-			one_hot_xt = make_onehot(x[t], self.vocab_size)
-			self.deltaV += np.outer(delta_in, one_hot_xt)
+		# deltaV Updates
+		np.add.at(self.deltaV.T, X.ravel(), delta_in.reshape(B*T, self.hidden_dims))
 
-			# deltaU Updates
-			self.deltaU += np.outer(delta_in, s[t-1])
+		# deltaU Updates
+		self.deltaU += np.einsum('bti,btj->ij', delta_in, self._previous_states(S, T), optimize=True)
 
 	def acc_deltas_np(self, x, d, y, s):
 		'''
@@ -118,17 +247,17 @@ class RNN(Model):
 		'''
 		t = len(x)-1
 		# deltaW Updates
-		one_hot_dt = make_onehot(d[0], self.out_vocab_size)
-		delta_out = one_hot_dt - y[t]
-		self.deltaW = np.outer(delta_out, s[t])
+		delta_out = -y[t]
+		delta_out[d[0]] += 1
+		add_outer(self.deltaW, delta_out, s[t])
 
 		# deltaV Updates
-		delta_in = np.dot(np.transpose(self.W), delta_out) * grad(s[t])
-		one_hot_xt = make_onehot(x[t], self.vocab_size)
-		self.deltaV = np.outer(delta_in, one_hot_xt)
+		delta_in = dot_t(self.W, delta_out) * grad(s[t])
+		self.deltaV[:, x[t]] += delta_in
 
 		# deltaU Updates
-		self.deltaU = np.outer(delta_in, s[t-1])
+		s_prev = s[t-1] if t > 0 else s[len(x)]
+		add_outer(self.deltaU, delta_in, s_prev)
 		
 	def acc_deltas_bptt(self, x, d, y, s, steps):
 		'''
@@ -147,28 +276,39 @@ class RNN(Model):
 		
 		no return values
 		'''
-		for t in reversed(range(len(x))):
-			# deltaW Updates
-			one_hot_dt = make_onehot(d[t], self.out_vocab_size)
-			delta_out = one_hot_dt - y[t]
-			self.deltaW += np.outer(delta_out, s[t])
-
-			# Initialise first delta_in value
-			delta_in = np.dot(np.transpose(self.W), delta_out) * grad(s[t])
-			for t_ in range(steps+1):
-				one_hot_xt = make_onehot(x[t-t_], self.vocab_size)
-				delta_in_T = np.dot(np.transpose(self.U), delta_in) * grad(s[t-t_])
-				# Initial update when t_ == 0
-				if t_ == 0:
-					self.deltaV += np.outer(delta_in, one_hot_xt)
-					self.deltaU += np.outer(delta_in, s[t-1])
-				# Recursively update t-1, t-2, ..., t-t_
-				else:
-					self.deltaV += np.outer(delta_in_T, one_hot_xt)
-					self.deltaU += np.outer(delta_in_T, s[t-t_-1])
-					# Update delta_in to be current value of delta_in_T
-					# delta_in_T = np.dot(np.transpose(self.U), (delta_in_T+1)) * grad(s[t-t_])
-					delta_in = delta_in_T
+		x = np.asarray(x)
+		T = len(x)
+
+		# delta_out = onehot(d) - y, grad(s) and the initial delta_in for all time steps at once, one row per t
+		delta_out = -y[:T]
+		delta_out[np.arange(T), d] += 1
+		grad_s = grad(s[:T])
+		delta_in = (delta_out @ self.W) * grad_s
+
+		# deltaW Updates
+		self.deltaW += delta_out.T @ s[:T]
+
+		# walk back through time one step at a time, for all t at once: after t_ steps, row tau of
+		# delta_in holds the error that reached time tau from the output at time tau+t_.
+		# going back past t=0 only adds zeros (grad of the zero initial state is 0), so stop there.
+		# deltaU and deltaV are linear in these errors, so sum them per time step over the whole
+		# window first and apply all of it as one GEMM and one scatter.
+		# each step reads the previous errors from one buffer and writes the next into the other
+		delta_total = delta_in.copy()
+		delta_next = np.empty_like(delta_in)
+		U = self.U
+		for t_ in range(1, min(steps+1, T)):
+			n = T - t_
+			np.matmul(delta_in[1:n+1], U, out=delta_next[:n])
+			delta_next[:n] *= grad_s[:n]
+			delta_total[:n] += delta_next[:n]
+			delta_in, delta_next = delta_next, delta_in
+
+		# deltaV Updates
+		np.add.at(self.deltaV.T, x, delta_total)
+
+		# deltaU Updates
+		self.deltaU += delta_total.T @ self._previous_states(s, T)
 
 	def acc_deltas_bptt_np(self, x, d, y, s, steps):
 		'''
@@ -190,32 +330,29 @@ class RNN(Model):
 		'''
 		t = len(x)-1
 		# deltaW Updates
-		one_hot_dt = make_onehot(d[0], self.out_vocab_size)
-		delta_out = one_hot_dt - y[t]
-		self.deltaW = np.outer(delta_out, s[t])
+		delta_out = -y[t]
+		delta_out[d[0]] += 1
+		add_outer(self.deltaW, delta_out, s[t])
+		grad_s = grad(s[:t+1])
 		# Initialise first delta_in value
-		delta_in = np.dot(np.transpose(self.W), delta_out) * grad(s[t])
-		for t_ in range(min(steps+1, t)):
-			one_hot_xt = make_onehot(x[t-t_], self.vocab_size)
-			delta_in_T = np.dot(np.transpose(self.U), delta_in) * grad(s[t-t_])
-			# Initial update when t_ == 0
-			if t_ == 0:
-				self.deltaV += np.outer(delta_in, one_hot_xt)
-				self.deltaU += np.outer(delta_in, s[t-1])
-			# Recursively update t-1, t-2, ..., t-t_
-			else:
-				self.deltaV += np.outer(delta_in_T, one_hot_xt)
-				self.deltaU += np.outer(delta_in_T, s[t-t_-1])
-
-				# Log change in deltaU
-				# with open("rnn_deltaU.txt", "a") as f:
-				# 	matrix = np.outer(delta_in_T, s[t-t_-1])
-				# 	magnitude_row = np.linalg.norm(matrix, axis=1)
-				# 	single_magnitude = math.sqrt(sum(magnitude_row**2))
-				# 	f.write("\n")
-				# 	f.write("{}, {}, {}".format(t, t_, single_magnitude))
-
-
-				# Update delta_in to be current value of delta_in_T
-				# delta_in_T = np.dot(np.transpose(self.U), (delta_in_T+1)) * grad(s[t-t_])
-				delta_in = delta_in_T
\ No newline at end of file
+		delta_in = dot_t(self.W, delta_out) * grad_s[t]
+		window = min(steps+1, t)
+		# Initial update at time t
+		if window > 0:
+			self.deltaV[:, x[t]] += delta_in
+			add_outer(self.deltaU, delta_in, s[t-1])
+		# Recursively update t-1, t-2, ..., t-t_
+		U, deltaU, deltaV = self.U, self.deltaU, self.deltaV
+		for t_ in range(1, window):
+			delta_in = dot_t(U, delta_in)
+			delta_in *= grad_s[t-t_]
+			deltaV[:, x[t-t_]] += delta_in
+			add_outer(deltaU, delta_in, s[t-t_-1])
+
+			# Log change in deltaU
+			# with open("rnn_deltaU.txt", "a") as f:
+			# 	matrix = np.outer(delta_in, s[t-t_-1])
+			# 	magnitude_row = np.linalg.norm(matrix, axis=1)
+			# 	single_magnitude = math.sqrt(sum(magnitude_row**2))
+			# 	f.write("\n")
+			# 	f.write("{}, {}, {}".format(t, t_, single_magnitude))
@@ -1,25 +1,71 @@
 import numpy as np
-
-def sigmoid(x):
-	return 1.0/(1.0 + np.exp(-x))
-
-def softmax(x):
-	xt = np.exp(x - max(x))
-	return xt / sum(xt)
+from functools import lru_cache
+from scipy.linalg.blas import get_blas_funcs
+
+def sigmoid(x, out=None):
+	# 1/(1 + exp(-x)), optionally written into out (which may be x itself).
+	# without out, works on a new float copy of x, so scalars and integer inputs work too
+	if out is None:
+		out = np.array(x, dtype=np.result_type(x, 1.0))
+		return sigmoid(out, out=out)[()]
+	np.negative(x, out=out)
+	np.exp(out, out=out)
+	out += 1.0
+	return np.divide(1.0, out, out=out)
+
+def softmax(x, out=None):
+	# normalises over the last axis, so a matrix is treated as one distribution per row.
+	# optionally written into out (which may be x itself), otherwise into a new float copy of x
+	if out is None:
+		out = np.array(x, dtype=np.result_type(x, 1.0))
+		x = out
+	np.subtract(x, np.max(x, axis=-1, keepdims=True), out=out)
+	np.exp(out, out=out)
+	out /= np.sum(out, axis=-1, keepdims=True)
+	return out
 
 def grad(x):
 	return x*(1-x)
 
+# largest size for which make_onehot keeps an n x n identity matrix around. the only caller left
+# is the GRU forward pass with its 2000 word vocabulary (-> 32MB). only the last two sizes are kept
+ONEHOT_CACHE_MAX = 2000
+
+@lru_cache(maxsize=2)
+def _identity(n):
+	eye = np.eye(n)
+	eye.flags.writeable = False
+	return eye
+
 def make_onehot(i, n):
-	y = np.zeros(n)
-	y[i] = 1
-	return y
+	# up to ONEHOT_CACHE_MAX, this is a READ-ONLY view of row i of a cached identity matrix, so nothing
+	# is allocated or zero-filled per call. copy the result before writing into it
+	if n > ONEHOT_CACHE_MAX:
+		y = np.zeros(n)
+		y[i] = 1
+		return y
+	return _identity(n)[i]
+
+def dot_t(a, x):
+	# a.T @ x as a BLAS matvec (?gemv). for a C-ordered a, a.T is already the Fortran-ordered
+	# matrix BLAS expects, so it is handed over as is and no transposed copy is made.
+	gemv = get_blas_funcs('gemv', (a, x))
+	return gemv(1.0, a.T, x)
+
+def add_outer(a, x, y):
+	# a += outer(x, y) in place, as a BLAS rank-1 update (?ger) instead of building the outer product first.
+	# for a C-ordered a, a.T is Fortran-ordered, so ger can overwrite it without making a copy.
+	if not a.flags.c_contiguous:
+		a += np.outer(x, y)
+		return
+	ger = get_blas_funcs('ger', (a,))
+	ger(1.0, y, x, a=a.T, overwrite_a=1)
 
 
 
 def fraq_loss(vocab, word_to_num, vocabsize):
-	fraction_lost = float(sum([vocab['count'][word] for word in vocab.index if (not word in word_to_num) and (not word == "UNK")]))
-	fraction_lost /= sum([vocab['count'][word] for word in vocab.index if (not word == "UNK")])
+	fraction_lost = float(sum(vocab['count'][word] for word in vocab.index if (not word in word_to_num) and (not word == "UNK")))
+	fraction_lost /= sum(vocab['count'][word] for word in vocab.index if (not word == "UNK"))
 	return fraction_lost
 
 def adjust_loss(loss, fracloss, q, mode='basic'):
@@ -91,6 +91,16 @@ def test():
 	else:
 		print("s passed")
 
+	print("\n### predicting into buffers")
+	y_buf, s_buf = r.prediction_buffers(len(x)+2)
+	s_buf.fill(1)
+	y2,s2 = r.predict_into(x, y_buf, s_buf)
+	if not (np.isclose(y_exp, y2, rtol=1e-08, atol=1e-08).all() and np.isclose(s_exp, s2, rtol=1e-08, atol=1e-08).all()):
+		print("y,s expected\n{0}\n{1}".format(y_exp, s_exp))
+		print("y,s received\n{0}\n{1}".format(y2, s2))
+	else:
+		print("buffered y,s passed")
+
 	print("\n### computing loss and mean loss")
 	loss = p.compute_loss(x,d)
 	loss2 = p.compute_loss(x2,d2)
@@ -130,6 +140,22 @@ def test():
 	else:
 		print("deltaW passed")
 
+	print("\n### standard BP over a batch")
+	# the same sequence twice, so the batched updates should be twice those of acc_deltas
+	r.deltaU.fill(0)
+	r.deltaV.fill(0)
+	r.deltaW.fill(0)
+
+	r.acc_deltas_batched(np.array([x,x]), np.array([d,d]), np.array([y,y]), np.array([s,s]))
+	batched = True
+	for name, expected in (("deltaU", deltaU_1_exp), ("deltaV", deltaV_1_exp), ("deltaW", deltaW_1_exp)):
+		if not np.isclose(2*expected, getattr(r, name)).all():
+			print("\n{0} expected\n{1}".format(name, 2*expected))
+			print("{0} received\n{1}".format(name, getattr(r, name)))
+			batched = False
+	if batched:
+		print("batched deltas passed")
+
 	print("\n### BPTT with 3 steps")
 	r.deltaU.fill(0)
 	r.deltaV.fill(0)
@@ -186,6 +212,19 @@ def test():
 		print("deltaW passed")
 
 
+	print("\n### binary prediction BP accumulates over calls")
+	# a second call must add to the deltas that apply_deltas uses, not replace them
+	r.acc_deltas_np(x,d_np,y,s)
+	accumulated = True
+	for name, expected in (("deltaU", deltaU_1_exp_np), ("deltaV", deltaV_1_exp_np), ("deltaW", deltaW_1_exp_np)):
+		if not np.isclose(2*expected, r._deltas[name]).all():
+			print("\n{0} expected\n{1}".format(name, 2*expected))
+			print("{0} received\n{1}".format(name, r._deltas[name]))
+			accumulated = False
+	if accumulated:
+		print("accumulation passed")
+
+
 	print("\n### binary prediction BPTT with 3 steps")
 	r.deltaU.fill(0)
 	r.deltaV.fill(0)
@@ -217,6 +256,32 @@ def test():
 	else:
 		print("acc passed")
 
+	print("\n### single precision RNN")
+	# same weights in float32, everything should stay float32 and match the expectations to float32 precision
+	r32 = RNN(vocabsize,hdim,vocabsize,fp32=True)
+	r32.V[:] = r.V
+	r32.W[:] = r.W
+	r32.U[:] = r.U
+
+	y32,s32 = r32.predict(x)
+	r32.acc_deltas(x,d,y32,s32)
+	deltas_bp = [r32.deltaU.copy(), r32.deltaV.copy(), r32.deltaW.copy()]
+	r32.reset_deltas()
+	r32.acc_deltas_bptt(x,d,y32,s32,3)
+	deltas_bptt = [r32.deltaU, r32.deltaV, r32.deltaW]
+
+	fp32 = True
+	checks = [("y", y_exp, y32), ("s", s_exp, s32)]
+	checks += list(zip(("deltaU BP", "deltaV BP", "deltaW BP"), (deltaU_1_exp, deltaV_1_exp, deltaW_1_exp), deltas_bp))
+	checks += list(zip(("deltaU BPTT", "deltaV BPTT", "deltaW BPTT"), (deltaU_3_exp, deltaV_3_exp, deltaW_3_exp), deltas_bptt))
+	for name, expected, received in checks:
+		if received.dtype != np.float32 or not np.isclose(expected, received, rtol=0, atol=1e-5).all():
+			print("\n{0} expected (float32)\n{1}".format(name, expected))
+			print("{0} received ({1})\n{2}".format(name, received.dtype, received))
+			fp32 = False
+	if fp32:
+		print("float32 y, s and deltas passed")
+
 	# GRU Test
 
 	r = GRU(vocabsize,hdim,vocabsize)
@@ -1,4 +1,5 @@
 # coding: utf-8
+import os
 import re
 import numpy as np
 import pandas as pd
@@ -61,8 +62,9 @@ def pad_sequence(seq, left=1, right=1):
 # For RNN
 # just convert each sentence to a list of indices
 # after padding each with <s> ... </s> tokens
+# int32 holds any vocabulary index and halves the size of the index arrays
 def seq_to_indices(words, word_to_num):
-    return np.array([word_to_num[w] for w in words])
+    return np.array([word_to_num[w] for w in words], dtype=np.int32)
 
 
 def docs_to_indices(sents, word_to_num, pad_left=1, pad_right=1):
@@ -76,6 +78,37 @@ def docs_to_indices(sents, word_to_num, pad_left=1, pad_right=1):
     return np.array(sents_idx, dtype=object)
 
 
+# load and index a data set like docs_to_indices(load(fname), ...), caching the indexed sentences
+# in an npz file next to fname. the cache is keyed by loader, padding and vocabulary size, and is
+# rebuilt whenever fname is newer than it. if it cannot be written, the data is still returned.
+# sentences are stored as one flat array plus offsets so the cache can be read back without pickling.
+def load_indexed_dataset(fname, load, word_to_num, pad_left=1, pad_right=1):
+    cache = "{0}.{1}-{2}-{3}-{4}.cache.npz".format(fname, load.__name__, pad_left, pad_right, len(word_to_num))
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(fname):
+        with np.load(cache) as f:
+            flat, offsets = f['flat'], f['offsets']
+        return np.array(np.split(flat.astype(np.int32, copy=False), offsets[1:-1]), dtype=object)
+
+    sents_idx = docs_to_indices(load(fname), word_to_num, pad_left, pad_right)
+    offsets = np.concatenate(([0], np.cumsum([len(s) for s in sents_idx])))
+    # the cache is only a speed-up, so a data folder that cannot be written to is not an error
+    try:
+        np.savez(cache, flat=np.concatenate(sents_idx), offsets=offsets)
+    except OSError:
+        pass
+    return sents_idx
+
+
+# stack index sequences of different lengths into one (B, T_max) array for batched prediction.
+# also returns a (B, T_max) boolean mask that is False at the padding positions.
+def pad_indices(seqs, value=0):
+    lengths = np.array([len(s) for s in seqs])
+    mask = np.arange(lengths.max()) < lengths[:, None]
+    padded = np.full(mask.shape, value, dtype=np.int32)
+    padded[mask] = np.concatenate(seqs)
+    return padded, mask
+
+
 def offset_seq(seq):
     return seq[:-1], seq[1:]
 